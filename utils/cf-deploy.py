@@ -27,7 +27,8 @@ which are then consumed by application stacks.
 
 Invocation:
 
-  cf-deploy.py STACK_NAME TEMPLATE_PATH [CONFIG_FILE] [ NAME=VALUE [...] ]
+  cf-deploy.py [OPTIONS] STACK_NAME TEMPLATE_PATH [CONFIG_FILE] [ NAME=VALUE [...] ]
+  cf-deploy.py [OPTIONS] --manifest MANIFEST_FILE [--parallel COUNT] [CONFIG_FILE]
 
 Where:
 
@@ -38,6 +39,26 @@ Where:
                 template parameters via name/value pairs).
   NAME / VALUE  values for template parameters; these override any values
                 from the saved configuration or current stack.
+  MANIFEST_FILE is the path to a JSON file that lists stacks to be deployed
+                concurrently; see below.
+  COUNT         is the maximum number of stacks to deploy at the same time
+                (default 8).
+
+Options:
+
+  --profile NAME            the AWS profile to use (default credentials if
+                            omitted).
+  --region NAME             the region to deploy into (default region if
+                            omitted).
+  --dry-run                 report the parameters that would be applied to each
+                            stack, without creating or updating it. Templates
+                            aren't uploaded, so a template that's too large to
+                            pass directly must have a cached validation.
+  --template-bucket BUCKET  an S3 bucket used to hold templates that are too
+                            large to pass directly to CloudFormation (51,200
+                            bytes). Required only if you have such templates.
+  --no-validate-cache       always validate templates, rather than reusing the
+                            results of a previous validation (see below).
 
 Notes:
 
@@ -50,15 +71,92 @@ Notes:
 
   When updating an existing stack, you need only specify parameters that
   have changed; others will be retrieved from the stack.
+
+  A manifest file contains an array of objects, each of which has "stack"
+  and "template" fields corresponding to STACK_NAME and TEMPLATE_PATH, and
+  an optional "overrides" object of parameter names and values. Stacks in
+  a manifest are deployed at the same time, so must not depend on each
+  others' outputs. Outputs from all successful stacks are written to the
+  config file after all stacks have finished.
+
+  The results of validating a template are cached in ~/.cache/cf-deploy, and
+  reused if the template hasn't changed. Use --no-validate-cache to always
+  validate the template.
+
+  If the orjson module is installed, it's used to read and write the config
+  file; otherwise the standard json module is used.
 """
 
 
+import argparse
 import boto3
+import functools
+import hashlib
 import json
-import os.path
+import mmap
+import os
 import sys
+import threading
 import time
 
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from botocore.config import Config as ClientConfig
+from botocore.exceptions import ClientError, WaiterError
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# the largest template that CloudFormation accepts as TemplateBody
+TEMPLATE_BODY_LIMIT = 51200
+
+
+# where Template stores the results of validating a template
+VALIDATION_CACHE_DIR = "~/.cache/cf-deploy"
+
+
+# parsed configuration files, keyed by absolute path and modification time, so
+# that a file is only read once no matter how many Config objects use it
+_STORE_CACHE = {}
+
+
+def _load_store(path):
+    """ Returns the contents of a saved configuration file, or an empty dict if
+        the file does not exist. The caller gets its own copy of the contents.
+    """
+    path = os.path.abspath(path)
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return {}
+    key = (path, st.st_mtime_ns)
+    store = _STORE_CACHE.get(key)
+    if store is None:
+        with open(path, 'rb') as f:
+            data = f.read()
+        store = orjson.loads(data) if orjson else json.loads(data)
+        _STORE_CACHE[key] = store
+    return dict(store)
+
+
+def _save_store(path, store):
+    """ Writes a configuration file in place, so that a symlinked file is updated
+        rather than replaced, and the file keeps its permissions and ownership.
+    """
+    path = os.path.abspath(path)
+    if orjson:
+        data = orjson.dumps(store)
+    else:
+        data = json.dumps(store, separators=(',', ':')).encode('utf-8')
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o666)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    for key in [k for k in _STORE_CACHE if k[0] == path]:
+        del _STORE_CACHE[key]
+
 
 class Config:
     """ Manages the saved configuration and overrides.
@@ -79,13 +177,10 @@ class Config:
     def __init__(self, saved_config_path, cli_params=None):
         self.saved_config_path = saved_config_path
         self.saved_config = {}
-        if self.saved_config_path and os.path.exists(self.saved_config_path):
-            with open(self.saved_config_path) as f:
-                self.saved_config = json.load(f)
-        self.cli_params = {}
-        for arg in (cli_params or []):
-            kv = arg.split('=')
-            self.cli_params[kv[0]] = kv[1]
+        if self.saved_config_path:
+            self.saved_config = _load_store(self.saved_config_path)
+        # partition, not split, so that values may contain '='
+        self.cli_params = {k: v for k, _, v in (arg.partition('=') for arg in (cli_params or [])) if k}
 
     def get(self, name, existing=None):
         """ Returns the value of a parameter from highest-precedence source.
@@ -94,6 +189,13 @@ class Config:
             or existing \
             or self.saved_config.get(name)
 
+    def as_merged_dict(self, existing=None):
+        """ Returns a dict that combines all sources, with the same precedence as
+            get(). As with get(), empty values don't override other sources.
+        """
+        sources = (self.saved_config, existing or {}, self.cli_params)
+        return {k: v for source in sources for k, v in source.items() if v}
+
     def update_and_save(self, new_params, path=None):
         """ Updates the default parameter file and saves it. This is called by the
             stack-builder when it extracts stack outputs.
@@ -111,8 +213,7 @@ class Config:
             return
         self.saved_config.update(new_params)
         try:
-            with open(path, "w") as f:
-                json.dump(self.saved_config, f)
+            _save_store(path, self.saved_config)
         except PermissionError:
             print("unable to write stack outputs to configuration file")
 
@@ -124,12 +225,24 @@ class Template:
         By default the template is loaded and validated at construction-time. This
         will populate the exposed instance variables. For testing, you can defer
         loading until a later time.
+
+        Templates larger than CloudFormation allows to be passed inline are
+        uploaded to the template bucket, using the provided S3 client, and
+        referenced by URL. The upload happens when the template is first
+        needed, and never happens for a dry run.
+
+        Validation results are cached in VALIDATION_CACHE_DIR, keyed by the hash
+        of the template body, so that an unchanged template isn't re-validated.
     """
 
-    def __init__(self, client, path, eager_load=True):
+    def __init__(self, client, path, eager_load=True, use_cache=True, template_bucket=None, s3_client=None, dry_run=False):
         self.client = client
         self.template_path = path
-        self.param_names = set()
+        self.use_cache = use_cache
+        self.template_bucket = template_bucket
+        self.s3_client = s3_client
+        self.dry_run = dry_run
+        self.param_names = frozenset()
         self.default_values = {}
         if eager_load:
             self.load()
@@ -137,80 +250,184 @@ class Template:
     def load(self):
         """ Loads and validates the template.
         """
-        with open(self.template_path) as f:
-            self.template_body = f.read()
-        response = client.validate_template(TemplateBody=self.template_body)
+        # mapping the file lets us decode directly into the body string, rather
+        # than reading into a bytes buffer and then decoding that; templates that
+        # are too large to pass inline are never decoded
+        with open(self.template_path, 'rb') as f:
+            # an empty file can't be mapped, and isn't a valid template anyway
+            if os.fstat(f.fileno()).st_size == 0:
+                raise ValueError(f"{self.template_path} is empty")
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                self.template_hash = hashlib.sha256(mm).hexdigest()
+                if len(mm) <= TEMPLATE_BODY_LIMIT:
+                    self.template_body = str(mm, 'utf-8')
+                    self.template_args = {'TemplateBody': self.template_body}
+                else:
+                    # uploaded by source_args(), if and when needed
+                    self.template_body = None
+                    self.template_args = None
+        cached = self._read_validation_cache() if self.use_cache else None
+        if cached:
+            self.capabilities_needed = cached['capabilities']
+            self.param_names = frozenset(cached['param_names'])
+            self.default_values = cached['default_values']
+            return
+        if self.template_args is None and self.dry_run:
+            raise ValueError(f"{self.template_path} exceeds {TEMPLATE_BODY_LIMIT} bytes; can't validate without uploading it")
+        response = self.client.validate_template(**self.source_args())
         self.capabilities_needed = response.get('Capabilities', [])
-        for param in response.get('Parameters', []):
-            param_name = param['ParameterKey']
-            self.param_names.add(param_name)
-            default_value = param.get('DefaultValue')
-            if default_value:
-                self.default_values[param_name] = default_value
-
-    def apply(self, stack_name, saved_config):
-        stack = Stack(self.client, stack_name, self, saved_config)
-        stack.create_or_update()
+        params = response.get('Parameters', [])
+        self.param_names = frozenset(p['ParameterKey'] for p in params)
+        self.default_values = {p['ParameterKey']: p['DefaultValue'] for p in params if p.get('DefaultValue')}
+        if self.use_cache:
+            self._write_validation_cache()
+
+    def source_args(self):
+        """ Returns the arguments that identify the template in a CloudFormation request,
+            uploading the template if it's too large to pass inline.
+        """
+        if self.template_args is None:
+            self.template_args = {'TemplateURL': self._upload()}
+        return self.template_args
+
+    def _upload(self):
+        """ Uploads the template to S3, returning its URL.
+        """
+        if not (self.template_bucket and self.s3_client):
+            raise ValueError(f"{self.template_path} exceeds {TEMPLATE_BODY_LIMIT} bytes; must specify a template bucket")
+        key = f"cf-deploy/{self.template_hash}{os.path.splitext(self.template_path)[1]}"
+        with open(self.template_path, 'rb') as f:
+            self.s3_client.put_object(Bucket=self.template_bucket, Key=key, Body=f)
+        region = _bucket_region(self.s3_client, self.template_bucket)
+        domain = "amazonaws.com.cn" if region.startswith("cn-") else "amazonaws.com"
+        return f"https://{self.template_bucket}.s3.{region}.{domain}/{key}"
+
+    def _validation_cache_path(self):
+        return os.path.join(os.path.expanduser(VALIDATION_CACHE_DIR), f"{self.template_hash}.json")
+
+    def _read_validation_cache(self):
+        try:
+            with open(self._validation_cache_path()) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_validation_cache(self):
+        # if this fails, the template is validated again next time
+        path = self._validation_cache_path()
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, "w") as f:
+                json.dump({
+                    'capabilities': self.capabilities_needed,
+                    'param_names': sorted(self.param_names),
+                    'default_values': self.default_values
+                }, f)
+            os.replace(tmp_path, path)
+        except OSError:
+            pass
+
+    def apply(self, stack_name, saved_config, prefetched=None, dry_run=False):
+        stack = Stack(self.client, stack_name, self, saved_config, prefetched)
+        if dry_run:
+            stack.report_changes()
+        else:
+            stack.create_or_update()
         return stack
 
 
 class Stack:
     """ Creates or updates a stack, and holds information about it.
+
+        If given the result of prefetch_all(), existing stack information is
+        taken from it rather than retrieved; a stack that isn't in the map is
+        assumed not to exist.
     """
 
-    def __init__(self, client, stack_name, template, config):
+    def __init__(self, client, stack_name, template, config, prefetched=None):
         self.client = client
         self.stack_name = stack_name
         self.template = template
         self.config = config
+        self.prefetched = prefetched
         self.existing_params = {}
 
+    @staticmethod
+    def prefetch_all(client):
+        """ Retrieves descriptions of all stacks in the account, as a map keyed by
+            stack name. This is cheaper than individual lookups when deploying
+            many stacks.
+        """
+        paginator = client.get_paginator('describe_stacks')
+        return {s['StackName']: s
+                for page in paginator.paginate()
+                for s in page['Stacks']
+                if s['StackStatus'] != 'DELETE_COMPLETE'}
+
     def create_or_update(self):
         self._retrieve_stack_info()
         self._build_parameter_list()
-        if self.stack_id:
-            self._update_stack()
-        else:
+        self.created = not self.stack_id
+        if self.created:
             self._create_stack()
+        else:
+            self._update_stack()
         self._wait_until_done()
         self._extract_outputs()
 
+    def report_changes(self):
+        """ Prints the operation and parameters that create_or_update() would use,
+            without changing the stack.
+        """
+        self._retrieve_stack_info()
+        self._build_parameter_list()
+        print(f"would {'update' if self.stack_id else 'create'} stack: {self.stack_name}")
+        for param in self.params_to_apply:
+            print(f"    {param['ParameterKey']} = {param['ParameterValue']}")
+
     def updated_succeeded(self):
         if self.timedout:
-            return false
+            return False
         return self.status == 'CREATE_COMPLETE' or self.status == 'UPDATE_COMPLETE'
 
     def _retrieve_stack_info(self):
-        paginator = client.get_paginator('describe_stacks')
-        for page in paginator.paginate():
-            for stack in page['Stacks']:
-                if stack['StackName'] == self.stack_name:
-                    self.stack_id = stack['StackId']
-                    for param in stack.get('Parameters', []):
-                        k = param['ParameterKey']
-                        v = param['ParameterValue']
-                        self.existing_params[k] = v
-                    return
-        self.stack_id = None
-        
+        if self.prefetched is not None:
+            stack = self.prefetched.get(self.stack_name)
+        else:
+            stack = self._describe_stack()
+        if not stack:
+            self.stack_id = None
+            return
+        self.stack_id = stack['StackId']
+        for param in stack.get('Parameters', []):
+            k = param['ParameterKey']
+            v = param['ParameterValue']
+            self.existing_params[k] = v
+
+    def _describe_stack(self):
+        try:
+            return self.client.describe_stacks(StackName=self.stack_name)['Stacks'][0]
+        except ClientError as ex:
+            # CloudFormation reports a missing stack as a validation error
+            if 'does not exist' in ex.response['Error']['Message']:
+                return None
+            raise
+
     def _build_parameter_list(self):
-        self.params_to_apply = []
-        for name in template.param_names:
-            value = self.config.get(name, self.existing_params.get(name))
-            if value:
-                self.params_to_apply.append({
-                    'ParameterKey': name,
-                    'ParameterValue': value
-                })
+        merged = self.config.as_merged_dict(existing=self.existing_params)
+        self.params_to_apply = [{'ParameterKey': name, 'ParameterValue': merged[name]}
+                                for name in self.template.param_names
+                                if merged.get(name)]
 
     def _create_stack(self):
-        print("creating new stack")
-        response = client.create_stack(
+        print(f"creating new stack: {self.stack_name}")
+        response = self.client.create_stack(
             StackName=self.stack_name,
-            TemplateBody=template.template_body,
+            **self.template.source_args(),
             Parameters=self.params_to_apply,
             TimeoutInMinutes=30,
-            Capabilities=template.capabilities_needed,
+            Capabilities=self.template.capabilities_needed,
             OnFailure='DO_NOTHING'
             )
         self.stack_id = response['StackId']
@@ -218,59 +435,215 @@ class Stack:
 
     def _update_stack(self):
         print(f"updating existing stack: {self.stack_id}")
-        response = client.update_stack(
+        self.client.update_stack(
             StackName=self.stack_id,
-            TemplateBody=template.template_body,
+            **self.template.source_args(),
             Parameters=self.params_to_apply,
-            Capabilities=template.capabilities_needed
+            Capabilities=self.template.capabilities_needed
             )
 
     def _wait_until_done(self):
+        # the SDK waiters stop polling as soon as the stack reaches a terminal
+        # state; they only succeed on the *_COMPLETE state for the operation
+        waiter_name = 'stack_create_complete' if self.created else 'stack_update_complete'
+        waiter = self.client.get_waiter(waiter_name)
+        # the waiter doesn't expose individual polls, so we report only the
+        # start of the wait and the status that ended it
         self.timedout = False
-        for x in range(0, 15 * 4 * 30):
-            print(f"waiting for stack ({x * 15} seconds)")
-            desc = self.client.describe_stacks(StackName=self.stack_id)
-            self.status = desc['Stacks'][0]['StackStatus']
-            if self.status.endswith("COMPLETE") or self.status.endswith("FAILED"):
-                return
-            time.sleep(15)
-        print("timed out")
-        self.timedout = True
+        print(f"waiting for stack: {self.stack_name}")
+        start = time.monotonic()
+        try:
+            waiter.wait(StackName=self.stack_id, WaiterConfig={'Delay': 10, 'MaxAttempts': 180})
+            self._last_desc = self.client.describe_stacks(StackName=self.stack_id)['Stacks'][0]
+        except WaiterError as ex:
+            stacks = (ex.last_response or {}).get('Stacks') or [{}]
+            self._last_desc = stacks[0]
+            if 'Max attempts exceeded' in str(ex):
+                print(f"timed out: {self.stack_name}")
+                self.timedout = True
+        self.status = self._last_desc.get('StackStatus')
+        print(f"stack {self.stack_name} is {self.status} ({int(time.monotonic() - start)} seconds)")
 
     def _extract_outputs(self):
-        self.outputs = {}
-        desc = client.describe_stacks(StackName=self.stack_id)
-        for output in desc['Stacks'][0].get('Outputs', []):
-            self.outputs[output['OutputKey']] = output['OutputValue']
+        # uses the description retrieved when the stack finished, rather than
+        # making another call
+        self.outputs = {o['OutputKey']: o['OutputValue'] for o in self._last_desc.get('Outputs', [])}
 
 
-if __name__ == "__main__":
-    if len(sys.argv) < 3:
-        print(__doc__, file=sys.stderr)
-        sys.exit(1)
+@functools.lru_cache(maxsize=None)
+def _bucket_region(s3_client, bucket):
+    # buckets in us-east-1 have no location constraint, and some very old buckets
+    # in eu-west-1 report it as "EU"
+    location = s3_client.get_bucket_location(Bucket=bucket).get('LocationConstraint')
+    return {None: 'us-east-1', 'EU': 'eu-west-1'}.get(location, location)
 
-    stack_name = sys.argv[1]
-    template_path = sys.argv[2]
-    config_path = None
-    param_values = []
-    if len(sys.argv) > 3:
-        if "=" in sys.argv[3]:
-            param_values = sys.argv[3:]
-        else:
-            config_path = sys.argv[3]
-            param_values = sys.argv[4:]
 
-    # print(f"stack_name    = {stack_name}")
-    # print(f"template_path = {template_path}")
-    # print(f"config_path   = {config_path}")
-    # print(f"param_values  = {param_values}")
+def create_session(profile=None, region=None):
+    """ Creates the session used for all clients, so that they use the same credentials
+        and region.
+    """
+    return boto3.Session(profile_name=profile, region_name=region)
+
 
-    client = boto3.client('cloudformation')
+def create_client(session, service='cloudformation', max_pool_connections=16):
+    """ Creates a client for use by all other objects. Clients are created before any
+        threads are started, because sessions aren't thread-safe. Concurrent manifest
+        deployments poll many stacks at once, which CloudFormation may throttle.
+    """
+    client_config = ClientConfig(
+        retries={'mode': 'adaptive', 'max_attempts': 10},
+        max_pool_connections=max_pool_connections,
+        tcp_keepalive=True)
+    return session.client(service, config=client_config)
+
+
+def deploy_stack(client, stack_name, template_path, config_path, param_values, dry_run=False, **template_options):
+    """ Deploys a single stack, saving its outputs if successful. Any additional
+        keyword arguments are passed to the Template constructor.
+    """
     config = Config(config_path, param_values)
-    template = Template(client, template_path)
-    stack = template.apply(stack_name, config)
+    template = Template(client, template_path, dry_run=dry_run, **template_options)
+    stack = template.apply(stack_name, config, dry_run=dry_run)
+    if dry_run:
+        return stack
     if stack.updated_succeeded():
         config.update_and_save(stack.outputs)
         print("complete")
     else:
         print(f"failed: {stack.status}")
+    return stack
+
+
+def deploy_manifest(client, manifest_path, config_path, max_workers, dry_run=False, **template_options):
+    """ Deploys all stacks listed in a manifest file, and returns the combined
+        outputs of those that succeeded. Any additional keyword arguments are
+        passed to the Template constructor.
+    """
+    with open(manifest_path) as f:
+        entries = json.load(f)
+
+    # for more than a few stacks, one paginated retrieval is cheaper than
+    # individual describe calls
+    prefetched = Stack.prefetch_all(client) if len(entries) > 3 else None
+
+    def deploy_one(entry):
+        overrides = [f"{k}={v}" for k,v in entry.get('overrides', {}).items()]
+        config = Config(config_path, overrides)
+        template = Template(client, entry['template'], dry_run=dry_run, **template_options)
+        return template.apply(entry['stack'], config, prefetched, dry_run)
+
+    outputs = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(deploy_one, entry): entry['stack'] for entry in entries}
+        for future in as_completed(futures):
+            stack_name = futures[future]
+            try:
+                stack = future.result()
+            except Exception as ex:
+                print(f"failed: {stack_name}: {ex}")
+                continue
+            if dry_run:
+                continue
+            if stack.updated_succeeded():
+                outputs.update(stack.outputs)
+                print(f"complete: {stack_name}")
+            else:
+                print(f"failed: {stack_name}: {stack.status}")
+    return outputs
+
+
+def parse_args(argv):
+    """ Parses all arguments. Positional arguments are returned as a list, because
+        their meaning depends on whether we're using a manifest.
+    """
+    arg_parser = argparse.ArgumentParser(description="Creates or updates CloudFormation stacks.")
+    arg_parser.add_argument("--profile",
+                            metavar="NAME",
+                            dest='profile',
+                            help="""The AWS profile used to deploy stacks; if omitted, uses the
+                                    default credentials.
+                                    """)
+    arg_parser.add_argument("--region",
+                            metavar="NAME",
+                            dest='region',
+                            help="""The region where stacks are deployed; if omitted, uses the
+                                    default region.
+                                    """)
+    arg_parser.add_argument("--manifest",
+                            metavar="MANIFEST_FILE",
+                            dest='manifest',
+                            help="""A JSON file listing stacks that will be deployed concurrently.
+                                    """)
+    arg_parser.add_argument("--parallel",
+                            metavar="COUNT",
+                            dest='parallel',
+                            type=int,
+                            default=8,
+                            help="""The maximum number of stacks from a manifest to deploy at the
+                                    same time (default 8).
+                                    """)
+    arg_parser.add_argument("--template-bucket",
+                            metavar="BUCKET",
+                            dest='template_bucket',
+                            help="""An S3 bucket used to hold templates that are too large to
+                                    pass directly to CloudFormation.
+                                    """)
+    arg_parser.add_argument("--no-validate-cache",
+                            action='store_false',
+                            dest='use_cache',
+                            help="""Always validate templates, rather than reusing the results
+                                    of a previous validation.
+                                    """)
+    arg_parser.add_argument("--dry-run",
+                            action='store_true',
+                            dest='dry_run',
+                            help="""Report the parameters that would be applied to each stack,
+                                    without creating or updating it.
+                                    """)
+    arg_parser.add_argument("args",
+                            nargs='*',
+                            metavar="ARG",
+                            help="""STACK_NAME TEMPLATE_PATH [CONFIG_FILE] [NAME=VALUE ...], or
+                                    just [CONFIG_FILE] when using a manifest.
+                                    """)
+    return arg_parser.parse_intermixed_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args(sys.argv[1:])
+
+    positional = args.args
+    if (args.manifest and len(positional) > 1) or (not args.manifest and len(positional) < 2):
+        print(__doc__, file=sys.stderr)
+        sys.exit(1)
+
+    session = create_session(args.profile, args.region)
+    client = create_client(session, 'cloudformation', max(16, args.parallel))
+    template_options = {
+        'use_cache': args.use_cache,
+        'template_bucket': args.template_bucket,
+        's3_client': create_client(session, 's3', max(16, args.parallel)) if args.template_bucket else None
+    }
+
+    if args.manifest:
+        config_path = positional[0] if positional else None
+        outputs = deploy_manifest(client, args.manifest, config_path, args.parallel, args.dry_run, **template_options)
+        Config(config_path).update_and_save(outputs)
+    else:
+        stack_name = positional[0]
+        template_path = positional[1]
+        config_path = None
+        param_values = []
+        if len(positional) > 2:
+            if "=" in positional[2]:
+                param_values = positional[2:]
+            else:
+                config_path = positional[2]
+                param_values = positional[3:]
+
+        # print(f"stack_name    = {stack_name}")
+        # print(f"template_path = {template_path}")
+        # print(f"config_path   = {config_path}")
+        # print(f"param_values  = {param_values}")
+
+        deploy_stack(client, stack_name, template_path, config_path, param_values, args.dry_run, **template_options)
@@ -16,21 +16,41 @@
 ################################################################################
 
 import argparse
-import boto3
-import json
+import functools
 import os
-import re
 import sys
+import threading
 
+from botocore.exceptions import ClientError
+from concurrent.futures import ThreadPoolExecutor
 
-# arg_parser is a global so that we can write help text from multiple places
-arg_parser = None
 
+# all clients are created from a single session, so that credentials are only
+# resolved once; it's created on first use, so that argument errors don't pay
+# the cost of loading botocore
+_session = None
+_client_config = None
 
-def parse_args(argv):
-    """ Parses all arguments, defaulting to environment variables if present.
+
+# the region, if it's set in the environment; AWS_REGION (set by Lambda and
+# CloudShell) is honored as well as AWS_DEFAULT_REGION
+_REGION = os.environ.get('AWS_REGION') or os.environ.get('AWS_DEFAULT_REGION')
+
+
+# arguments that default to environment variables (other than assign_public_ip,
+# which is a flag)
+_ENV_DEFAULTS = (
+    ('cluster',             "ECS_CLUSTER"),
+    ('subnets',             "ECS_SUBNETS"),
+    ('security_groups',     "ECS_SECURITY_GROUPS"),
+    ('task_execution_role', "ECS_TASK_EXECUTION_ROLE"),
+    ('task_role',           "ECS_TASK_ROLE"),
+)
+
+
+def _build_parser():
+    """ Creates the argument parser. This is called once, at module load.
         """
-    global arg_parser
     arg_parser = argparse.ArgumentParser(description="Runs an ECS task in Fargate.")
     arg_parser.add_argument("--cluster",
                             metavar="CLUSTER_NAME",
@@ -103,13 +123,22 @@ def parse_args(argv):
                                     KEY=VALUE or CONTAINER:KEY=VALUE. Former applies to all containers
                                     in the task definition, latter to a specific container.
                                     """)
-    args = arg_parser.parse_args(argv)
-    args.cluster = args.cluster or os.environ.get("ECS_CLUSTER")
-    args.subnets = args.subnets or os.environ.get("ECS_SUBNETS")
-    args.security_groups = args.security_groups or os.environ.get("ECS_SECURITY_GROUPS")
-    args.assign_public_ip = args.assign_public_ip or (os.environ.get("ECS_ASSIGN_PUBLIC_IP", "false").lower() == "true")
-    args.task_execution_role = args.task_execution_role or os.environ.get("ECS_TASK_EXECUTION_ROLE")
-    args.task_role= args.task_role or os.environ.get("ECS_TASK_ROLE")
+    return arg_parser
+
+
+# the parser is a global so that we can write help text from multiple places
+_PARSER = _build_parser()
+
+
+def parse_args(argv):
+    """ Parses all arguments, defaulting to environment variables if present.
+        """
+    args = _PARSER.parse_args(argv)
+    environ = os.environ
+    for attr, envar in _ENV_DEFAULTS:
+        if not getattr(args, attr):
+            setattr(args, attr, environ.get(envar))
+    args.assign_public_ip = args.assign_public_ip or (environ.get("ECS_ASSIGN_PUBLIC_IP", "false").lower() == "true")
     return args
 
 
@@ -120,19 +149,67 @@ def exit_if_none(value, message):
     if value is None:
         print(message)
         print()
-        arg_parser.print_help()
+        _PARSER.print_help()
         sys.exit(1)
     else:
         return value
 
 
+# client creation isn't thread-safe, although the clients themselves are
+_client_lock = threading.Lock()
+
+
+def _use_orjson_for_requests():
+    """ If orjson is installed, replaces the JSON encoder used by botocore's request
+        serializers. The replacement is visible only to the serializer module, and
+        falls back to the standard encoder for any values that orjson rejects.
+        """
+    try:
+        import orjson
+    except ImportError:
+        return
+    import botocore.serialize
+    import json
+    import types
+    def dumps(obj, **kwargs):
+        try:
+            return orjson.dumps(obj).decode('utf-8')
+        except TypeError:
+            return json.dumps(obj, **kwargs)
+    botocore.serialize.json = types.SimpleNamespace(dumps=dumps, loads=json.loads)
+
+
+@functools.lru_cache(maxsize=None)
+def _client(service):
+    """ Returns a client for the named service, creating it on first use. The
+        config keeps connections alive and fails fast, since all calls are
+        simple lookups.
+        """
+    global _session, _client_config
+    with _client_lock:
+        if _session is None:
+            import botocore.session
+            from botocore.config import Config
+            _session = botocore.session.get_session()
+            _use_orjson_for_requests()
+            _client_config = Config(
+                retries={'max_attempts': 2, 'mode': 'standard'},
+                connect_timeout=2,
+                read_timeout=10,
+                tcp_keepalive=True)
+        client_args = {'config': _client_config}
+        if _REGION:
+            client_args['region_name'] = _REGION
+        return _session.create_client(service, **client_args)
+
+
 def validate_cluster(cluster):
-    """ Verifies that the named cluster exists.
+    """ Verifies that the named cluster exists and is active.
         """
     if cluster is None:
         return None
-    clusters = boto3.client('ecs').describe_clusters(clusters=["Default"])['clusters']
-    if len(clusters) != 1:
+    clusters = _client('ecs').describe_clusters(clusters=[cluster])['clusters']
+    if len(clusters) != 1 or clusters[0]['status'] != 'ACTIVE':
         exit_if_none(None, f"invalid cluster: {cluster}")
     return clusters[0]['clusterArn']
 
@@ -141,14 +218,20 @@ def validate_subnets(subnet_spec):
     """ Splits the provided string and verifies that each subnet exists.
         """
     exit_if_none(subnet_spec, "Missing subnets")
+    subnet_ids = subnet_spec.split(",")
+    try:
+        response = _client('ec2').describe_subnets(SubnetIds=subnet_ids)
+    except ClientError as ex:
+        # EC2 throws if any of the subnets don't exist
+        if ex.response['Error']['Code'].startswith('InvalidSubnetID'):
+            return exit_if_none(None, f"invalid subnet: {ex.response['Error']['Message']}")
+        raise
     actual_subnets = {}
-    paginator = boto3.client('ec2').get_paginator('describe_subnets')
-    for page in paginator.paginate():
-        for subnet in page['Subnets']:
-            actual_subnets[subnet['SubnetId']] = subnet['VpcId']
+    for subnet in response['Subnets']:
+        actual_subnets[subnet['SubnetId']] = subnet['VpcId']
     subnets = []
     vpcs = set()
-    for subnet_id in subnet_spec.split(","):
+    for subnet_id in subnet_ids:
         vpc_id = actual_subnets.get(subnet_id)
         exit_if_none(vpc_id, f"invalid subnet: {subnet_id}")
         subnets.append(subnet_id)
@@ -162,14 +245,20 @@ def validate_security_groups(sg_spec):
     """ Splits the provided string and verifies that each security group exists.
         """
     exit_if_none(sg_spec, "Missing security groups")
+    sg_ids = sg_spec.split(",")
+    try:
+        response = _client('ec2').describe_security_groups(GroupIds=sg_ids)
+    except ClientError as ex:
+        # EC2 throws if any of the groups don't exist
+        if ex.response['Error']['Code'].startswith('InvalidGroup'):
+            return exit_if_none(None, f"invalid security group: {ex.response['Error']['Message']}")
+        raise
     actual_sgs = {}
-    paginator = boto3.client('ec2').get_paginator('describe_security_groups')
-    for page in paginator.paginate():
-        for sg in page['SecurityGroups']:
-            actual_sgs[sg['GroupId']] = sg.get('VpcId') # some people may still have non-VPC groups
+    for sg in response['SecurityGroups']:
+        actual_sgs[sg['GroupId']] = sg.get('VpcId') # some people may still have non-VPC groups
     security_groups = []
     vpcs = set()
-    for sg_id in sg_spec.split(","):
+    for sg_id in sg_ids:
         vpc_id = actual_sgs.get(sg_id)
         exit_if_none(vpc_id, f"invalid security group: {sg_id}")
         security_groups.append(sg_id)
@@ -183,12 +272,31 @@ def validate_role(name_or_arn):
     """ Verifies that the specified role exists, matching either by name or
         full ARN. Returns the role ARN if valid.
         """
-    paginator = boto3.client('iam').get_paginator('list_roles')
-    for page in paginator.paginate():
-        for role in page['Roles']:
-            if (name_or_arn == role['Arn']) or (name_or_arn == role['RoleName']):
-                return role['Arn']
-    exit_if_none(None, f"invalid role name/ARN: {name_or_arn}")
+    is_arn = name_or_arn.startswith("arn:")
+    role_name = name_or_arn.rsplit("/", 1)[-1] if is_arn else name_or_arn
+    try:
+        role_arn = _client('iam').get_role(RoleName=role_name)['Role']['Arn']
+    except ClientError as ex:
+        if ex.response['Error']['Code'] == 'NoSuchEntity':
+            return exit_if_none(None, f"invalid role name/ARN: {name_or_arn}")
+        raise
+    if is_arn and role_arn != name_or_arn:
+        # eg, same name but different path or account
+        return exit_if_none(None, f"invalid role name/ARN: {name_or_arn}")
+    return role_arn
+
+
+def qualified_taskdef_name(taskdef_name, version):
+    """ Returns the task definition name, qualified by version if one is given.
+        """
+    return f"{taskdef_name}:{version}" if version else taskdef_name
+
+
+@functools.lru_cache(maxsize=None)
+def _describe_taskdef(taskdef_name):
+    """ Retrieves the task definition, remembering it for later calls.
+        """
+    return _client('ecs').describe_task_definition(taskDefinition=taskdef_name).get('taskDefinition')
 
 
 def validate_task_definition(taskdef_name, version):
@@ -197,100 +305,136 @@ def validate_task_definition(taskdef_name, version):
         the task definition ARN if valid.
         """
     exit_if_none(taskdef_name, "Missing task definition name")
-    if version:
-        taskdef_name = f"{taskdef_name}:{version}"
+    taskdef_name = qualified_taskdef_name(taskdef_name, version)
     try:
-        # ECS throws if it can't find a task definition
-        taskdef = boto3.client('ecs').describe_task_definition(taskDefinition=taskdef_name).get('taskDefinition')
+        taskdef = _describe_taskdef(taskdef_name)
         return taskdef['taskDefinitionArn']
-    except:
-        return exit_if_none(None, f"can't find task definition: {taskdef_name}")
+    except ClientError as ex:
+        # ECS reports a missing or malformed task definition as a client error
+        if ex.response['Error']['Code'] in ('ClientException', 'InvalidParameterException'):
+            return exit_if_none(None, f"can't find task definition: {taskdef_name}")
+        raise
 
 
 def retrieve_container_names(taskdef_name):
     """ Retrieves the task definition and returns a list of the containers
         that it contains.
         """
-    taskdef = boto3.client('ecs').describe_task_definition(taskDefinition=taskdef_name).get('taskDefinition')
+    taskdef = _describe_taskdef(taskdef_name)
     containers = []
     for container in taskdef['containerDefinitions']:
         containers.append(container['name'])
     return containers
 
 
+def _is_identifier(value, extra_chars=""):
+    """ Determines whether the passed value consists of ASCII letters, digits,
+        underscores, and any extra characters specified.
+        """
+    for c in extra_chars + "_":
+        value = value.replace(c, "")
+    return value.isascii() and (value == "" or value.isalnum())
+
+
+def _parse_envar_spec(spec):
+    """ Parses an environment override in the form KEY=VALUE or CONTAINER:KEY=VALUE.
+        Returns a tuple of container name (None if not specified), variable name,
+        and value; returns None if the override is invalid.
+        """
+    target, sep, env_value = spec.partition("=")
+    container_name, colon, env_name = target.partition(":")
+    if not colon:
+        container_name, env_name = None, target
+    elif not (container_name and _is_identifier(container_name, "-")):
+        return None
+    if not (sep and env_name and _is_identifier(env_name)):
+        return None
+    return container_name, env_name, env_value
+
+
 def apply_environment_overrides(container_names, envar_specs):
-    """ Applies environment variable overrides to the passed list
-        of containers. Returns a dict, keyed by container name,
-        where each item in the dict has name-value pairs for the
-        environment overrides that apply to that container.
+    """ Parses environment variable overrides for the passed list
+        of containers. Returns a tuple of the overrides that apply
+        to all containers, and a dict, keyed by container name, of
+        the overrides that apply to only that container. Both have
+        name-value pairs for the environment overrides.
         """
-    matcher = re.compile(r"(([-\w]+):)*(\w+)=(.*)", re.ASCII)
-    overrides_by_container = dict([[k,dict()] for k in container_names])
+    global_overrides = {}
+    overrides_by_container = {k: {} for k in container_names}
     for spec in envar_specs:
-        match = matcher.match(spec)
-        exit_if_none(match, f"invalid environment override: {spec}")
-        container_name = match.group(2)
-        env_name = match.group(3)
-        env_value = match.group(4)
+        parsed = _parse_envar_spec(spec)
+        exit_if_none(parsed, f"invalid environment override: {spec}")
+        container_name, env_name, env_value = parsed
         if container_name:
             container_override = overrides_by_container.get(container_name)
             exit_if_none(container_override, f"invalid container for override: {container_name}")
             container_override[env_name] = env_value
         else:
-            for container_override in overrides_by_container.values():
-                container_override[env_name] = env_value
-    return overrides_by_container
+            global_overrides[env_name] = env_value
+    return global_overrides, overrides_by_container
 
 
 def construct_container_overrides(taskdef_name, envar_specs):
     container_names = retrieve_container_names(taskdef_name)
-    env_overrides = apply_environment_overrides(container_names, envar_specs)
-    result = []
-    for container_name in container_names:
-        container_env = []
-        for k,v in env_overrides.get(container_name, {}).items():
-            container_env.append({
-                "name": k,
-                "value": v
-            })
-        result.append({
+    global_overrides, overrides_by_container = apply_environment_overrides(container_names, envar_specs)
+    return [
+        {
             "name": container_name,
-            "environment": container_env
-        })
-    return result
+            "environment": [
+                {"name": k, "value": v}
+                for k,v in {**global_overrides, **overrides_by_container.get(container_name, {})}.items()
+            ]
+        }
+        for container_name in container_names
+    ]
 
 
 if __name__ == "__main__":
     args = parse_args(sys.argv[1:])
 
-    run_args = {
-        'taskDefinition': validate_task_definition(args.taskdef, args.taskdef_version),
-        'count': 1,
-        'launchType': 'FARGATE',
-        'enableECSManagedTags': True,
-        'enableExecuteCommand': False,
-        'networkConfiguration': {
-            'awsvpcConfiguration': {
-                'subnets': validate_subnets(args.subnets),
-                'securityGroups': validate_security_groups(args.security_groups),
-                'assignPublicIp': 'ENABLED' if args.assign_public_ip else 'DISABLED'
+    # validations are independent API calls, so run them concurrently; if any
+    # fails, the SystemExit from exit_if_none() is re-raised by result()
+    with ThreadPoolExecutor(max_workers=6) as executor:
+        taskdef_future = executor.submit(validate_task_definition, args.taskdef, args.taskdef_version)
+        subnets_future = executor.submit(validate_subnets, args.subnets)
+        sgs_future = executor.submit(validate_security_groups, args.security_groups)
+        cluster_future = executor.submit(validate_cluster, args.cluster) if args.cluster else None
+        execution_role_future = executor.submit(validate_role, args.task_execution_role) if args.task_execution_role else None
+        task_role_future = executor.submit(validate_role, args.task_role) if args.task_role else None
+
+        # the task definition is cached once validated, so retrieving containers
+        # for overrides doesn't require another call
+        taskdef_arn = taskdef_future.result()
+        taskdef_name = qualified_taskdef_name(args.taskdef, args.taskdef_version)
+
+        run_args = {
+            'taskDefinition': taskdef_arn,
+            'count': 1,
+            'launchType': 'FARGATE',
+            'enableECSManagedTags': True,
+            'enableExecuteCommand': False,
+            'networkConfiguration': {
+                'awsvpcConfiguration': {
+                    'subnets': subnets_future.result(),
+                    'securityGroups': sgs_future.result(),
+                    'assignPublicIp': 'ENABLED' if args.assign_public_ip else 'DISABLED'
+                }
+            },
+            'overrides': {
+                'containerOverrides': construct_container_overrides(taskdef_name, args.envars),
             }
-        },
-        'overrides': {
-            'containerOverrides': construct_container_overrides(args.taskdef, args.envars),
         }
-    }
-
-    if args.cluster:
-        run_args['cluster'] = validate_cluster(args.cluster)
-    if args.task_execution_role:
-        run_args['overrides']['executionRoleArn'] = validate_role(args.task_execution_role)
-    if args.task_role:
-        run_args['overrides']['taskRoleArn'] = validate_role(args.task_role)
-    if args.enable_exec:
-        run_args['enableExecuteCommand'] = True
-
-    response = boto3.client('ecs').run_task(**run_args)
+
+        if cluster_future:
+            run_args['cluster'] = cluster_future.result()
+        if execution_role_future:
+            run_args['overrides']['executionRoleArn'] = execution_role_future.result()
+        if task_role_future:
+            run_args['overrides']['taskRoleArn'] = task_role_future.result()
+        if args.enable_exec:
+            run_args['enableExecuteCommand'] = True
+
+    response = _client('ecs').run_task(**run_args)
     task_arn = response['tasks'][0]['taskArn']
-    task_id = re.sub(r".*/", "", task_arn)
+    task_id = task_arn.rpartition("/")[2]
     print(f"task ID: {task_id}")
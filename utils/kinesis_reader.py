@@ -21,7 +21,7 @@ trim horizon or end of the stream.
 
 Invocation:
 
-    kinesis_reader.py STREAM_NAME [STARTING_AT [POLL_INTERVAL]]
+    kinesis_reader.py [--format FORMAT] [--consumer NAME] STREAM_NAME [STARTING_AT [POLL_INTERVAL]]
 
 Where:
 
@@ -31,6 +31,8 @@ Where:
                   an additional argument; see below.
     POLL_INTERVAL is the number of seconds to wait between read attempts.
                   Default is 10.
+    FORMAT        is the output format: json (the default) or msgpack.
+    NAME          is the name of an Enhanced Fan-Out consumer; see below.
 
 Notes:
 
@@ -53,27 +55,110 @@ Notes:
     If the data record is itself a stringified JSON object, you can extract
     it by piping output into jq with the query '.Data|fromjson'.
 
-    For multi-shard streams, all message from a single shared are retrieved
-    before moving to the next shard.
+    For multi-shard streams, shards are read concurrently, but all messages
+    from a single shard are output before moving to the next shard.
+
+    Shards that return no records for several consecutive polls are polled
+    less often: every 2, then 4, then 8 intervals (limited so that their shard
+    iterators don't expire). Any records, or a non-zero MillisBehindLatest,
+    return the shard to being polled every interval.
+
+    If you specify a consumer name, records are read using Enhanced Fan-Out:
+    they're pushed to the reader as they arrive, rather than polled, and the
+    reader gets dedicated throughput. The consumer is registered if it doesn't
+    already exist, and deregistered on exit if this program registered it (you
+    pay for registered consumers). In this mode, POLL_INTERVAL is ignored, and
+    records from different shards are interleaved. When a shard is closed by
+    resharding, its child shards are read from their start; the reader exits
+    once all shards have been closed.
+
+    If the orjson module is installed, it's used to write the output.
+
+    The msgpack format requires the msgpack module. It writes a stream of maps
+    with the same fields as the JSON output, except that Data is the raw bytes
+    of the record (after decompression), without any attempt to decode them.
 """
 
+import argparse
 import boto3
 import calendar
 import gzip
+import itertools
 import json
+import queue
+import threading
 import time
 import sys
 
-from datetime import timezone
+from botocore.config import Config as ClientConfig
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+# after this many consecutive empty reads, a shard is polled less frequently
+IDLE_THRESHOLD = 2
+
+# the maximum number of poll cycles between reads of an idle shard
+MAX_POLL_SKIP = 8
+
+# the number of times that a lagging shard is read by a single call to retrieve_records();
+# GetRecords is limited to five calls per second per shard
+MAX_READS_PER_POLL = 5
+
+# GetRecords is also limited to 2 MiB per second per shard; a lagging shard is only
+# read again while the data returned for it stays under this rate
+MAX_BYTES_PER_SECOND = 2 * 1024 * 1024
+
+# shard iterators expire after five minutes; idle shards must be read before then
+ITERATOR_LIFETIME = 240
+
+
+# the default connection pool size; main() enlarges it for streams with many shards
+MAX_POOL_CONNECTIONS = 64
+
+# the maximum number of shards read at the same time
+MAX_READ_THREADS = 32
+
+
+def create_client(max_pool_connections=MAX_POOL_CONNECTIONS):
+    """ Creates the Kinesis client. Keepalive holds connections open while main sleeps
+        between polls, and the read timeout is long enough for Enhanced Fan-Out, where a
+        subscription receives an event every five seconds.
+    """
+    return boto3.client('kinesis', config=ClientConfig(
+        retries={'mode': 'adaptive', 'max_attempts': 10},
+        max_pool_connections=max_pool_connections,
+        connect_timeout=2,
+        read_timeout=30,
+        tcp_keepalive=True))
 
 
-client = boto3.client('kinesis')
+client = create_client()
+
+# shared by all calls to retrieve_records(), so that threads aren't created on every poll
+executor = ThreadPoolExecutor(max_workers=MAX_READ_THREADS)
 
 
 def parse_timestamp(value):
-    for fmt in ["%Y-%m-%dT%H:%M:%S", "%Y-%m-%d %H:%M:%S"]:
+    """ Parses a UTC timestamp in the form "YYYY-MM-DDTHH:MM:SS" (or with a space in place
+        of the "T"), or a number of seconds since the epoch. The former is parsed by slicing
+        the string, since it has a fixed layout; datetime validates the fields.
+    """
+    if len(value) == 19 and value[4] == '-' and value[7] == '-' and value[10] in 'T ' and value[13] == ':' and value[16] == ':':
         try:
-            return calendar.timegm(time.strptime(value, fmt))
+            dt = datetime(int(value[0:4]), int(value[5:7]), int(value[8:10]),
+                          int(value[11:13]), int(value[14:16]), int(value[17:19]))
+            return calendar.timegm(dt.timetuple())
         except ValueError:
             pass
     try:
@@ -85,60 +170,258 @@ def parse_timestamp(value):
 def retrieve_shards(stream_name):
     """ Retrieves information about all shards for the specified stream.
     """
-    result = []
     paginator = client.get_paginator('describe_stream')
-    for page in paginator.paginate(StreamName=stream_name):
-        result += page['StreamDescription']['Shards']
-    return result
+    pages = paginator.paginate(StreamName=stream_name)
+    return list(itertools.chain.from_iterable(page['StreamDescription']['Shards'] for page in pages))
 
 
 def retrieve_shard_iterators(stream_name, shards, iterator_type, timestamp=None):
     """ Returns a map of shard ID to iterator.
     """
+    request = {'StreamName': stream_name, 'ShardIteratorType': iterator_type}
+    if timestamp:
+        request['Timestamp'] = timestamp
     result = {}
     for shard in shards:
         shard_id = shard['ShardId']
-        if timestamp:
-            resp = client.get_shard_iterator(StreamName=stream_name, ShardId=shard_id, ShardIteratorType=iterator_type, Timestamp=timestamp)
-        else:
-            resp = client.get_shard_iterator(StreamName=stream_name, ShardId=shard_id, ShardIteratorType=iterator_type)
+        resp = client.get_shard_iterator(ShardId=shard_id, **request)
         result[shard_id] = resp['ShardIterator']
     return result
 
 
-def retrieve_records(iterators):
-    """ Retrieves all records for the provided iterator map, updating the map with new iterators.
+def retrieve_records(iterators, decode_data=True, poll_state=None, max_skip=MAX_POLL_SKIP):
+    """ A generator that yields all records for the provided iterator map, updating the map
+        with a shard's new iterator after yielding that shard's records. Shards are read
+        concurrently, up to MAX_READ_THREADS at a time, but records are returned in shard
+        order. If decode_data is False, record data is returned as bytes rather than a
+        UTF-8 string.
+
+        A shard that's behind the tip of the stream is read up to MAX_READS_PER_POLL times,
+        as long as the data returned stays under MAX_BYTES_PER_SECOND. Each read is issued
+        before the previous batch is yielded, so there's at most one outstanding per shard.
+
+        If poll_state is provided, it must be a dict that's passed unchanged to each call. It's
+        used to skip idle shards, for up to max_skip calls between reads.
     """
-    result = []
-    for shard_id, itx in iterators.items():
-        resp = client.get_records(ShardIterator=itx)
-        for rec in resp['Records']:
-            data = rec['Data']
-            if data.startswith(b'\x1f\x8b'):
-                 data = gzip.decompress(data)
-            result.append({
-                'SequenceNumber':               rec['SequenceNumber'],
-                'ApproximateArrivalTimestamp':  rec['ApproximateArrivalTimestamp'].astimezone(timezone.utc).isoformat(),
-                'Data':                         data.decode('utf-8'),
-                'PartitionKey':                 rec['PartitionKey']
-                })
-        iterators[shard_id] = resp['NextShardIterator']
-    return result
+    shard_ids = list(iterators.keys())
+    if poll_state is not None:
+        shard_ids = [shard_id for shard_id in shard_ids if _should_poll(poll_state, shard_id)]
+    if not shard_ids:
+        return
+    start = time.monotonic()
+    futures = [executor.submit(client.get_records, ShardIterator=iterators[shard_id]) for shard_id in shard_ids]
+    for shard_id, future in zip(shard_ids, futures):
+        bytes_read = 0
+        for read_count in range(1, MAX_READS_PER_POLL + 1):
+            resp = future.result()
+            next_iterator = resp['NextShardIterator']
+            bytes_read += sum(len(rec['Data']) for rec in resp['Records'])
+            within_limit = bytes_read < MAX_BYTES_PER_SECOND * (time.monotonic() - start)
+            # if the shard is behind, request its next batch before processing this
+            # one, so that the request overlaps writing the output
+            if read_count < MAX_READS_PER_POLL and next_iterator and within_limit and resp.get('MillisBehindLatest', 0) > 0:
+                future = executor.submit(client.get_records, ShardIterator=next_iterator)
+            else:
+                future = None
+            for rec in resp['Records']:
+                yield _format_record(rec, decode_data)
+            iterators[shard_id] = next_iterator
+            if poll_state is not None:
+                _update_poll_state(poll_state, shard_id, resp, max_skip)
+            if not future:
+                break
+
+
+def _format_record(rec, decode_data):
+    data = rec['Data']
+    if data.startswith(b'\x1f\x8b'):
+         data = gzip.decompress(data)
+    return {
+        'SequenceNumber':               rec['SequenceNumber'],
+        'ApproximateArrivalTimestamp':  rec['ApproximateArrivalTimestamp'].astimezone(timezone.utc).isoformat(),
+        'Data':                         data.decode('utf-8') if decode_data else data,
+        'PartitionKey':                 rec['PartitionKey']
+        }
+
+
+def _should_poll(poll_state, shard_id):
+    state = poll_state.setdefault(shard_id, {'empty_polls': 0, 'skip': 0})
+    if state['skip'] > 0:
+        state['skip'] -= 1
+        return False
+    return True
+
+
+def _update_poll_state(poll_state, shard_id, resp, max_skip):
+    """ Backs off exponentially for shards that have been idle. A shard that returns
+        records, or that's behind the tip of the stream, is polled on every cycle.
+    """
+    state = poll_state[shard_id]
+    if resp['Records'] or resp.get('MillisBehindLatest', 0) > 0:
+        state['empty_polls'] = 0
+    else:
+        state['empty_polls'] += 1
+    if state['empty_polls'] > IDLE_THRESHOLD:
+        state['skip'] = min(2 ** (state['empty_polls'] - IDLE_THRESHOLD), max_skip) - 1
+
+
+def register_consumer(stream_name, consumer_name):
+    """ Registers an Enhanced Fan-Out consumer for the stream, or uses an existing consumer
+        with the same name, and waits for it to become active. Returns the consumer's ARN
+        and a flag that indicates whether this call registered it.
+
+        If a consumer with the same name is being deleted (eg, by a previous run), waits
+        for the deletion to finish and then registers a new consumer.
+    """
+    stream_arn = client.describe_stream_summary(StreamName=stream_name)['StreamDescriptionSummary']['StreamARN']
+    while True:
+        try:
+            consumer = client.register_stream_consumer(StreamARN=stream_arn, ConsumerName=consumer_name)['Consumer']
+            created = True
+            break
+        except client.exceptions.ResourceInUseException:
+            pass
+        try:
+            consumer = client.describe_stream_consumer(StreamARN=stream_arn, ConsumerName=consumer_name)['ConsumerDescription']
+        except client.exceptions.ResourceNotFoundException:
+            continue
+        if consumer['ConsumerStatus'] != 'DELETING':
+            created = False
+            break
+        print(f"waiting for consumer {consumer_name} to be deleted", file=sys.stderr)
+        time.sleep(1)
+    consumer_arn = consumer['ConsumerARN']
+    while consumer['ConsumerStatus'] != 'ACTIVE':
+        if consumer['ConsumerStatus'] == 'DELETING':
+            raise RuntimeError(f"consumer {consumer_name} was deleted before it became active")
+        time.sleep(1)
+        consumer = client.describe_stream_consumer(ConsumerARN=consumer_arn)['ConsumerDescription']
+    return consumer_arn, created
+
+
+class ShardClosed:
+    """ Put onto the output queue by subscribe_to_shard() when its shard has been closed
+        (due to resharding), identifying the shards that replaced it.
+    """
+    def __init__(self, shard_id, child_shard_ids):
+        self.shard_id = shard_id
+        self.child_shard_ids = child_shard_ids
+
+
+def subscribe_to_shard(consumer_arn, shard_id, starting_position, output, decode_data=True):
+    """ Reads a single shard using Enhanced Fan-Out, putting each batch of records onto the
+        output queue. A subscription lasts for five minutes, after which this resubscribes
+        from the last continuation sequence number. When the shard is closed, puts a
+        ShardClosed onto the queue and returns.
+    """
+    while True:
+        resp = client.subscribe_to_shard(ConsumerARN=consumer_arn, ShardId=shard_id, StartingPosition=starting_position)
+        for event in resp['EventStream']:
+            shard_event = event['SubscribeToShardEvent']
+            if shard_event['Records']:
+                output.put([_format_record(rec, decode_data) for rec in shard_event['Records']])
+            continuation = shard_event.get('ContinuationSequenceNumber')
+            if not continuation:
+                child_shard_ids = [child['ShardId'] for child in shard_event.get('ChildShards', [])]
+                output.put(ShardClosed(shard_id, child_shard_ids))
+                return
+            starting_position = {'Type': 'AFTER_SEQUENCE_NUMBER', 'SequenceNumber': continuation}
+
+
+def retrieve_fan_out_records(consumer_arn, shards, iterator_type, timestamp=None, decode_data=True):
+    """ A generator that subscribes to all shards, each on its own thread, and yields batches
+        of records as they arrive. When a shard is closed, subscribes to its children from
+        the start. Returns once all subscribed shards are closed, and raises any exception
+        from a subscription thread.
+    """
+    starting_position = {'Type': iterator_type}
+    if timestamp:
+        starting_position['Timestamp'] = timestamp
+    output = queue.Queue()
+    def reader(shard_id, position):
+        try:
+            subscribe_to_shard(consumer_arn, shard_id, position, output, decode_data)
+        except Exception as ex:
+            output.put(ex)
+    # after a merge, both parents report the same child, so each shard is only started once
+    started = set()
+    def start(shard_id, position):
+        if shard_id not in started:
+            started.add(shard_id)
+            threading.Thread(target=reader, args=(shard_id, position), daemon=True).start()
+    for shard in shards:
+        start(shard['ShardId'], starting_position)
+    closed = set()
+    while closed != started:
+        item = output.get()
+        if isinstance(item, Exception):
+            raise item
+        if isinstance(item, ShardClosed):
+            closed.add(item.shard_id)
+            for child_shard_id in item.child_shard_ids:
+                start(child_shard_id, {'Type': 'TRIM_HORIZON'})
+        else:
+            yield item
+
+
+def write_records(records, output_format):
+    """ Writes records to stdout, flushing once they've all been written. The output is
+        passed to writelines() as a generator, so there's no per-record write() call.
+    """
+    if output_format == "msgpack":
+        sys.stdout.buffer.writelines(msgpack.packb(rec, use_bin_type=True) for rec in records)
+    else:
+        sys.stdout.buffer.writelines(to_json(rec) + b'\n' for rec in records)
+    sys.stdout.buffer.flush()
+
+
+def to_json(obj):
+    """ Serializes an object as UTF-8 encoded JSON, using orjson if it's available.
+        This returns bytes, so that orjson's output can be written without being
+        decoded to a string and then re-encoded.
+    """
+    if orjson:
+        return orjson.dumps(obj)
+    return json.dumps(obj).encode('utf-8')
 
 
 if __name__ == "__main__":
-    if len(sys.argv) < 2 or len(sys.argv) > 5:
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument("--format", choices=["json", "msgpack"], default="json")
+    parser.add_argument("--consumer")
+    parser.add_argument("args", nargs="*")
+    parsed = parser.parse_intermixed_args()
+    argv = [sys.argv[0]] + parsed.args
+
+    if len(argv) < 2 or len(argv) > 5:
         print(__doc__)
         sys.exit(1)
+    if parsed.format == "msgpack" and not msgpack:
+        print("msgpack output requires the msgpack module", file=sys.stderr)
+        sys.exit(1)
 
-    stream_name = sys.argv[1]
-    iterator_type = sys.argv[2] if len(sys.argv) > 2 else 'LATEST'
-    timestamp = parse_timestamp(sys.argv.pop(3)) if iterator_type == 'AT_TIMESTAMP' else None
-    poll_interval = int(sys.argv[3]) if len(sys.argv) > 3 else 10
+    stream_name = argv[1]
+    iterator_type = argv[2] if len(argv) > 2 else 'LATEST'
+    timestamp = parse_timestamp(argv.pop(3)) if iterator_type == 'AT_TIMESTAMP' else None
+    poll_interval = int(argv[3]) if len(argv) > 3 else 10
 
     shards = retrieve_shards(stream_name)
-    iterators = retrieve_shard_iterators(stream_name, shards, iterator_type, timestamp)
-    while True:
-        for rec in retrieve_records(iterators):
-            print(json.dumps(rec))
-        time.sleep(poll_interval)
+    if len(shards) * 2 > MAX_POOL_CONNECTIONS:
+        client = create_client(len(shards) * 2)
+    decode_data = parsed.format != "msgpack"
+
+    if parsed.consumer:
+        consumer_arn, created = register_consumer(stream_name, parsed.consumer)
+        try:
+            for records in retrieve_fan_out_records(consumer_arn, shards, iterator_type, timestamp, decode_data):
+                write_records(records, parsed.format)
+        finally:
+            if created:
+                client.deregister_stream_consumer(ConsumerARN=consumer_arn)
+    else:
+        iterators = retrieve_shard_iterators(stream_name, shards, iterator_type, timestamp)
+        poll_state = {}
+        max_skip = max(1, min(MAX_POLL_SKIP, ITERATOR_LIFETIME // max(poll_interval, 1)))
+        while True:
+            write_records(retrieve_records(iterators, decode_data, poll_state, max_skip), parsed.format)
+            time.sleep(poll_interval)
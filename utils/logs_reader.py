@@ -47,16 +47,33 @@ Notes:
 
     Messages are output in timestamp order, and when processing multiple streams
     the streams are ordered based on the timestamp of their last message.
+
+    If the orjson module is installed, it's used to write the output.
 """
 
 import boto3
+import collections
+import functools
+import itertools
 import json
 import sys
 
+from botocore.config import Config as ClientConfig
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
+from operator import itemgetter
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 
-client = boto3.client('logs')
+# sized for the stream reader threads in main
+client = boto3.client('logs', config=ClientConfig(
+    retries={'mode': 'adaptive', 'max_attempts': 10},
+    max_pool_connections=64,
+    tcp_keepalive=True))
 
 
 def retrieve_log_stream_names(log_group_name, prefixes=None):
@@ -64,47 +81,90 @@ def retrieve_log_stream_names(log_group_name, prefixes=None):
         If no prefixes are provided, returns all streams for the log group.
         Streams will be sorted by the timestamp of the last log event.
     """
-    streams = []
-    paginator = client.get_paginator('describe_log_streams')
     if prefixes:
-        for prefix in prefixes:
-            for page in paginator.paginate(logGroupName=log_group_name, logStreamNamePrefix=prefix):
-                streams += page['logStreams']
+        with ThreadPoolExecutor(max_workers=min(len(prefixes), 16)) as executor:
+            results = executor.map(lambda prefix: _retrieve_log_streams(log_group_name, prefix), prefixes)
+            streams = list(itertools.chain.from_iterable(results))
     else:
-        for page in paginator.paginate(logGroupName=log_group_name):
-            streams += page['logStreams']
+        streams = _retrieve_log_streams(log_group_name)
     streams.sort(key=lambda x: x['lastEventTimestamp'])
     return [x['logStreamName'] for x in streams]
 
 
+def _retrieve_log_streams(log_group_name, prefix=None):
+    """ Retrieves all streams for the log group that have the given prefix. Each
+        call uses its own paginator, so prefixes can be retrieved concurrently.
+    """
+    request = {'logGroupName': log_group_name}
+    if prefix:
+        request['logStreamNamePrefix'] = prefix
+    paginator = client.get_paginator('describe_log_streams')
+    return list(itertools.chain.from_iterable(page['logStreams'] for page in paginator.paginate(**request)))
+
+
+@functools.lru_cache(maxsize=4096)
+def _format_second(seconds):
+    return datetime.fromtimestamp(seconds, timezone.utc).strftime("%Y-%m-%dT%H:%M:%S")
+
+
+def format_timestamp(ts):
+    """ Formats a millis-since-epoch timestamp as an ISO-8601 UTC string, in the
+        same form as datetime.isoformat(). Events tend to cluster, so the part
+        of the string representing whole seconds is cached.
+    """
+    seconds, millis = divmod(ts, 1000)
+    if millis:
+        return f"{_format_second(seconds)}.{millis:03d}000+00:00"
+    return f"{_format_second(seconds)}+00:00"
+
+
 def read_log_messages(log_group_name, log_stream_name):
-    """ Retrieves all events from the specified log group/stream, formats the timestamp
-        as an ISO-8601 string, and sorts them by timestamp.
+    """ A generator that yields all events from the specified log group/stream, with
+        the timestamp formatted as an ISO-8601 string. Since we read from the head of
+        the stream, events are returned in timestamp order; each page is checked, and
+        sorted if it's out of order.
 
         Note: filter_log_events() takes an excessive amount of time if there are a large
         number of streams, even though we're only selecting from one, so instead we use 
         get_log_events(). However, Boto doesn't provide a paginator for it, so we have to
         handle the pagination ourselves. Fun!
     """
-    events = []
     request = {
         'logGroupName': log_group_name,
         'logStreamName': log_stream_name,
         'startTime': 0,
         'startFromHead': True
     } 
-    while True:
+    # the request for the next page is made before processing the current page,
+    # so that processing overlaps the network call
+    with ThreadPoolExecutor(max_workers=1) as executor:
         page = client.get_log_events(**request)
-        if page['nextForwardToken'] == request.get('nextToken'):
-            break;
-        request['nextToken'] = page['nextForwardToken']
-        for event in page['events']:
-            ts = event['timestamp']
-            event['originalTimestamp'] = ts
-            event['timestamp'] = datetime.fromtimestamp(ts / 1000, timezone.utc).isoformat()
-            events.append(event)
-    events.sort(key=lambda x: x['timestamp'])   # API doesn't guarantee order
-    return events
+        while page['nextForwardToken'] != request.get('nextToken'):
+            request['nextToken'] = page['nextForwardToken']
+            next_page = executor.submit(client.get_log_events, **request)
+            events = page['events']
+            # reading from the head returns events in order, so this check is normally
+            # all that happens; the sort uses the raw timestamp, before it's formatted
+            if any(a['timestamp'] > b['timestamp'] for a, b in zip(events, events[1:])):
+                events.sort(key=itemgetter('timestamp'))
+            for event in events:
+                ts = event['timestamp']
+                event['originalTimestamp'] = ts
+                event['timestamp'] = format_timestamp(ts)
+                yield event
+            page = next_page.result()
+
+
+def to_json(obj):
+    """ Serializes an object as UTF-8 encoded JSON, using orjson if it's available.
+    """
+    if orjson:
+        return orjson.dumps(obj)
+    return json.dumps(obj).encode('utf-8')
+
+
+def write_events(events):
+    sys.stdout.buffer.writelines(to_json(event) + b'\n' for event in events)
 
 if __name__ == "__main__":
     if len(sys.argv) < 2:
@@ -116,7 +176,16 @@ if __name__ == "__main__":
     else:
         prefixes = sys.argv[2:]
     stream_names = retrieve_log_stream_names(group_name, prefixes)
-    for stream_name in stream_names:
-        for event in read_log_messages(group_name, stream_name):
-            print(json.dumps(event))
-
+    # streams are read concurrently, but output in the order that they were
+    # submitted; each worker has to consume its generator, otherwise the reads
+    # would happen on this thread. To limit memory use when output is slow, a
+    # stream is only submitted once the oldest outstanding one is written
+    max_workers = 16
+    pending = collections.deque()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for stream_name in stream_names:
+            if len(pending) == max_workers:
+                write_events(pending.popleft().result())
+            pending.append(executor.submit(lambda name: list(read_log_messages(group_name, name)), stream_name))
+        while pending:
+            write_events(pending.popleft().result())
@@ -50,12 +50,34 @@
                     PGUSER=username \\
                     PGPASSWORD=password \\
                     PGDATABASE=dbname)
+
+    If you make repeated calls for the same secret, you can cache its value by
+    setting the environment variable SM_ENV_TTL to the number of seconds that
+    the cached value remains valid. The cache is stored in ~/.cache/sm-env,
+    readable only by the current user, and is keyed by secret name, region,
+    and the access key of the current credentials (so switching accounts or
+    roles doesn't return another account's secret). It's disabled by default,
+    or if SM_ENV_TTL isn't a positive integer.
+
+    If the orjson module is installed, it's used to parse JSON secrets.
     """
 
 import boto3
+import hashlib
 import json
 import os
 import sys
+import time
+
+from botocore.config import Config as ClientConfig
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+CACHE_DIR = "~/.cache/sm-env"
 
 
 def _check_usage(expected_arg_count=None):
@@ -64,18 +86,79 @@ def _check_usage(expected_arg_count=None):
         sys.exit(1)
 
 
+def _cache_ttl():
+    try:
+        return max(int(os.environ.get('SM_ENV_TTL', 0)), 0)
+    except ValueError:
+        return 0
+
+
+def _cache_path(session, secret_id):
+    credentials = session.get_credentials()
+    if credentials is None:
+        return None
+    key = f"{session.region_name}:{credentials.access_key}:{secret_id}"
+    digest = hashlib.sha256(key.encode('utf-8')).hexdigest()
+    return os.path.join(os.path.expanduser(CACHE_DIR), digest)
+
+
+def _read_cache(path, ttl):
+    try:
+        if time.time() - os.stat(path).st_mtime < ttl:
+            with open(path, encoding='utf-8') as f:
+                return f.read()
+    except OSError:
+        pass
+    return None
+
+
+def _write_cache(path, value):
+    """ Writes the value so that only the current user can read it. Errors are
+        ignored; the secret is simply retrieved again next time.
+    """
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(value)
+        os.replace(tmp_path, path)
+    except OSError:
+        pass
+
+
+def retrieve_secret(session, client, secret_id, ttl=0):
+    """ Returns the current value of the secret, from the cache if it's enabled
+        (ttl > 0) and has a sufficiently recent value. The session is the one that
+        created the client, and identifies the credentials used to retrieve it.
+    """
+    path = _cache_path(session, secret_id) if ttl > 0 else None
+    value = _read_cache(path, ttl) if path else None
+    if value is None:
+        value = client.get_secret_value(SecretId=secret_id, VersionStage='AWSCURRENT')['SecretString']
+        if path:
+            _write_cache(path, value)
+    return value
+
+
+def parse_json(value):
+    return orjson.loads(value) if orjson else json.loads(value)
+
+
 if __name__ == "__main__":
     _check_usage(2)
-    client = boto3.client('secretsmanager')
+    session = boto3.Session()
+    client = session.client('secretsmanager', config=ClientConfig(
+        retries={'mode': 'adaptive', 'max_attempts': 10}))
     secret_id = sys.argv[1]
-    value = client.get_secret_value(SecretId=secret_id)['SecretString']
+    value = retrieve_secret(session, client, secret_id, _cache_ttl())
 
     if os.path.basename(__file__) == 'sm-env.py':
         _check_usage(3)
         if not "=" in sys.argv[2]:
             print(f"export {sys.argv[2]}={value}")
         else:
-            lookup = json.loads(value)
+            lookup = parse_json(value)
             for arg in sys.argv[2:]:
                 kv = arg.split('=')
                 val = lookup.get(kv[1])
@@ -85,7 +168,7 @@ if __name__ == "__main__":
         if len(sys.argv) == 2:
             print(value)
         else:
-            lookup = json.loads(value)
+            lookup = parse_json(value)
             print(lookup[sys.argv[2]])
     else:
         _check_usage() # force exit